@@ -5,7 +5,6 @@ This version saves to an image file instead of opening an interactive viewer.
 """
 
 import os
-import struct
 
 import numpy as np
 import pyvista as pv
@@ -14,34 +13,43 @@ import pyvista as pv
 pv.OFF_SCREEN = True
 
 
-def load_lunar_window(filepath, center_x=11520, center_y=7680, size=1024):
-    """Load a window of lunar elevation data."""
+def load_lunar_window(filepath, center_x=11520, center_y=7680, size=1024, use_memmap=True, out=None):
+    """Load a window of lunar elevation data.
+    
+    Set use_memmap=False to read the rows spanning the window with a single
+    sequential read instead, for filesystems where memory-mapping is
+    unavailable or page faults are expensive.
+    
+    Pass a (size, size) float32 array as out to fill it in place, so repeated
+    loads can reuse one buffer.
+    """
     full_width = 23040
     full_height = 15360
     
     half_size = size // 2
-    start_x = max(0, center_x - half_size)
-    start_y = max(0, center_y - half_size)
-    
-    data = np.zeros((size, size), dtype=np.float32)
+    start_x = max(0, min(full_width - size, center_x - half_size))
+    start_y = max(0, min(full_height - size, center_y - half_size))
     
     print(f"Loading {size}x{size} window from ({center_x}, {center_y})...")
     
-    with open(filepath, 'rb') as f:
-        row_bytes = full_width * 4
-        
-        for i in range(size):
-            if (i + 1) % 256 == 0:
-                print(f"  Loading row {i+1}/{size}...")
-            
-            row_idx = start_y + i
-            f.seek(row_idx * row_bytes + start_x * 4)
-            row_data = f.read(size * 4)
-            values = struct.unpack(f'<{size}f', row_data)
-            data[i, :] = values
-    
-    # Convert from km to meters
-    data = data * 1000
+    # Samples are stored in km; convert to meters as part of the read
+    if use_memmap:
+        # Map the file as a row-major float32 array; only the pages touched by
+        # the window slice are read from disk.
+        mm = np.memmap(filepath, dtype='<f4', mode='r', shape=(full_height, full_width))
+        data = np.multiply(mm[start_y:start_y + size, start_x:start_x + size], np.float32(1000.0), out=out)
+        del mm
+    else:
+        # Read every full row spanned by the window in a single sequential
+        # read, then crop the columns.
+        strip_offset = start_y * full_width * 4
+        with open(filepath, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), strip_offset, size * full_width * 4, os.POSIX_FADV_SEQUENTIAL)
+            f.seek(strip_offset)
+            strip = np.fromfile(f, dtype='<f4', count=size * full_width).reshape(size, full_width)
+        data = np.multiply(strip[:, start_x:start_x + size], np.float32(1000.0), out=out)
+        del strip
     
     return data
 
@@ -50,13 +58,13 @@ def create_mesh(elevation_data, scale_z=0.001):
     """Create a 3D mesh from elevation data."""
     height, width = elevation_data.shape
     
-    x = np.arange(width)
-    y = np.arange(height)
-    xx, yy = np.meshgrid(x, y)
-    zz = elevation_data * scale_z
+    # A uniform grid keeps x/y implicit; only elevation is stored per point.
+    # Points run x-fastest, which matches the C order of the (row, col) array.
+    grid = pv.ImageData(dimensions=(width, height, 1), spacing=(1, 1, 1), origin=(0, 0, 0))
+    # A C-contiguous float32 ravel is a view VTK can wrap without copying.
+    grid["elevation"] = np.ascontiguousarray(elevation_data, dtype=np.float32).ravel()
     
-    mesh = pv.StructuredGrid(xx, yy, zz)
-    mesh["elevation"] = elevation_data.ravel(order="F")
+    mesh = grid.warp_by_scalar("elevation", factor=scale_z)
     
     return mesh
 
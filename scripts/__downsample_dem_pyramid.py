@@ -9,18 +9,27 @@ averaging non-overlapping 2x2 pixel blocks, and the results are written back to
 files named `*_CHUNKED_<N>.DAT` with decreasing chunk sizes `N = 256, 128, ...,
 2`.
 
+With --manifest, a `*_PYRAMID.json` file is also written next to each input.
+It records the tile bounds, the shared chunk grid and the per-level files and
+chunk byte sizes, so a consumer can seek straight to a single chunk of any
+level without reading the rest of the file.
+
 Example usage:
     python scripts/downsample_dem_pyramid.py
     python scripts/downsample_dem_pyramid.py --source-dir ./data/proc --overwrite
+    python scripts/downsample_dem_pyramid.py --manifest
 """
 
 from __future__ import annotations
 
 import argparse
+import functools
+import json
 import math
+import mmap
 import re
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
 import numpy as np
 
@@ -29,6 +38,11 @@ try:
 except ImportError:  # pragma: no cover - optional progress bar
     tqdm = None  # type: ignore
 
+try:
+    from numba import njit, prange
+except ImportError:  # pragma: no cover - optional JIT acceleration
+    njit = None  # type: ignore
+
 
 CHUNKED_PATTERN = re.compile(r"(_CHUNKED_)(\d+)", re.IGNORECASE)
 FLOAT32_BYTES = 4
@@ -48,14 +62,16 @@ def parse_lon(token: str) -> float:
     return float(token)
 
 
-def parse_lat_lon_span(name: str) -> Tuple[float, float]:
+@functools.lru_cache(maxsize=None)
+def parse_lat_lon_bounds(name: str) -> Tuple[float, float, float, float]:
     parts = name.split("_")
     if len(parts) < 8:
         raise ValueError(f"Cannot parse lat/lon span from {name}")
-    lat_a = parse_lat(parts[2])
-    lat_b = parse_lat(parts[3])
-    lon_a = parse_lon(parts[4])
-    lon_b = parse_lon(parts[5])
+    return parse_lat(parts[2]), parse_lat(parts[3]), parse_lon(parts[4]), parse_lon(parts[5])
+
+
+def parse_lat_lon_span(name: str) -> Tuple[float, float]:
+    lat_a, lat_b, lon_a, lon_b = parse_lat_lon_bounds(name)
     lat_span = abs(lat_a - lat_b)
     # Handle wrap-around for the final sector (e.g. 315 -> 360)
     if lon_b < lon_a:
@@ -66,18 +82,13 @@ def parse_lat_lon_span(name: str) -> Tuple[float, float]:
     return lat_span, lon_span
 
 
-def extract_chunk_size(path: Path) -> int:
-    match = CHUNKED_PATTERN.search(path.name)
-    if not match:
+def split_chunked_name(path: Path) -> Tuple[str, int, str]:
+    """Split `<prefix>_CHUNKED_<size><suffix>` into (`<prefix>_CHUNKED_`, size, suffix)."""
+    pieces = CHUNKED_PATTERN.split(path.name, maxsplit=1)
+    if len(pieces) != 4:
         raise ValueError(f"Filename does not contain _CHUNKED_<size>: {path.name}")
-    return int(match.group(2))
-
-
-def update_chunk_size_in_name(path: Path, new_size: int) -> Path:
-    def replacer(match: re.Match[str]) -> str:
-        return f"{match.group(1)}{new_size}"
-    new_name = CHUNKED_PATTERN.sub(replacer, path.name, count=1)
-    return path.with_name(new_name)
+    prefix, marker, size, suffix = pieces
+    return prefix + marker, int(size), suffix
 
 
 def infer_chunk_grid(total_values: int, chunk_size: int, lat_span: float, lon_span: float) -> Tuple[int, int]:
@@ -99,59 +110,159 @@ def infer_chunk_grid(total_values: int, chunk_size: int, lat_span: float, lon_sp
     return chunk_count_y, chunk_count_x
 
 
-def chunked_to_full(path: Path, chunk_size: int, chunks_y: int, chunks_x: int) -> np.ndarray:
-    shape = (chunks_y, chunks_x, chunk_size, chunk_size)
-    mm = np.memmap(path, dtype="<f4", mode="r", shape=shape)
+def write_manifest(path: Path, name_prefix: str, name_suffix: str, bounds: Tuple[float, float, float, float],
+                   chunks_y: int, chunks_x: int, base_chunk: int, min_chunk_size: int) -> Path:
+    lat_a, lat_b, lon_a, lon_b = bounds
+    levels = []
+    chunk_size = base_chunk
+    while True:
+        levels.append({
+            "chunk_size": chunk_size,
+            "file": f"{name_prefix}{chunk_size}{name_suffix}",
+            "chunk_bytes": chunk_size * chunk_size * FLOAT32_BYTES,
+        })
+        if chunk_size <= min_chunk_size:
+            break
+        chunk_size //= 2
+
+    manifest = {
+        "lat_range": [lat_a, lat_b],
+        "lon_range": [lon_a, lon_b],
+        "dtype": "<f4",
+        "chunks_x": chunks_x,
+        "chunks_y": chunks_y,
+        "levels": levels,
+    }
+    manifest_path = path.with_name(f"{name_prefix[:-len('_CHUNKED_')]}_PYRAMID.json")
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return manifest_path
+
+
+def advise_sequential(mm: np.memmap) -> None:
+    # Chunks are visited in file order, so ask the kernel for aggressive
+    # readahead (and early page reclaim) where madvise is available.
+    raw_map = getattr(mm, "_mmap", None)
+    if raw_map is not None and hasattr(raw_map, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        raw_map.madvise(mmap.MADV_SEQUENTIAL)
+
+
+if njit is not None:
+    @njit("void(f4[:, ::1], f4[:, ::1])", parallel=True, fastmath=True, cache=True)
+    def _down2(src, dst):
+        for i in prange(dst.shape[0]):
+            for j in range(dst.shape[1]):
+                dst[i, j] = 0.25 * (
+                    src[2 * i, 2 * j] +
+                    src[2 * i + 1, 2 * j] +
+                    src[2 * i, 2 * j + 1] +
+                    src[2 * i + 1, 2 * j + 1]
+                )
+else:
+    _down2 = None
+
+
+def downsample_by_two(grid: np.ndarray, out: Optional[np.ndarray] = None, band_rows: int = 1024) -> np.ndarray:
+    height, width = grid.shape
+    out_h, out_w = height // 2, width // 2
+    if out is None:
+        out = np.empty((out_h, out_w), dtype=grid.dtype)
+    # The kernel is compiled for C-contiguous float32 only; anything else
+    # takes the NumPy path so results never depend on numba being installed.
+    if (_down2 is not None and grid.dtype == np.float32 and out.dtype == np.float32
+            and grid.flags.c_contiguous and out.flags.c_contiguous):
+        _down2(grid, out)
+        return out
+    # Reduce in row bands so each band's input stays cache-resident.
+    for y0 in range(0, out_h, band_rows):
+        y1 = min(y0 + band_rows, out_h)
+        band = grid[2 * y0:2 * y1].reshape(y1 - y0, 2, out_w, 2)
+        np.sum(band, axis=(1, 3), out=out[y0:y1])
+        out[y0:y1] *= grid.dtype.type(0.25)
+    return out
+
+
+def write_levels(path: Path, outputs: Dict[int, Path], chunks_y: int, chunks_x: int, base_chunk: int, min_chunk_size: int) -> None:
+    # Levels are written to .tmp files and only renamed once every chunk is
+    # done, so an interrupted run never leaves a full-size partial level that
+    # a later run would skip as existing.
+    temp_paths = {chunk_size: output_path.with_name(output_path.name + ".tmp") for chunk_size, output_path in outputs.items()}
+
+    # One scratch buffer per level, reused for every chunk in the file.
+    buffers = {base_chunk: np.empty((base_chunk, base_chunk), dtype="<f4")}
+    current_chunk = base_chunk
+    while current_chunk > min_chunk_size:
+        current_chunk //= 2
+        buffers[current_chunk] = np.empty((current_chunk, current_chunk), dtype="<f4")
+
+    source = np.memmap(path, dtype="<f4", mode="r", shape=(chunks_y, chunks_x, base_chunk, base_chunk))
+    advise_sequential(source)
+    targets = {}
+    completed = False
     try:
-        full = np.array(mm.transpose(0, 2, 1, 3).reshape(chunks_y * chunk_size, chunks_x * chunk_size), copy=True)
+        for chunk_size, temp_path in temp_paths.items():
+            temp_path.parent.mkdir(parents=True, exist_ok=True)
+            targets[chunk_size] = np.memmap(temp_path, dtype="<f4", mode="w+", shape=(chunks_y, chunks_x, chunk_size, chunk_size))
+            advise_sequential(targets[chunk_size])
+
+        for cy in range(chunks_y):
+            for cx in range(chunks_x):
+                current = buffers[base_chunk]
+                current[...] = source[cy, cx]
+                current_chunk = base_chunk
+                while current_chunk > min_chunk_size:
+                    current_chunk //= 2
+                    current = downsample_by_two(current, out=buffers[current_chunk])
+                    if current_chunk in targets:
+                        targets[current_chunk][cy, cx] = current
+
+        for chunk_size in targets:
+            targets[chunk_size].flush()
+        completed = True
     finally:
-        del mm
-    return full
-
-
-def full_to_chunked(grid: np.ndarray, chunk_size: int, chunks_y: int, chunks_x: int) -> np.ndarray:
-    reshaped = grid.reshape(chunks_y, chunk_size, chunks_x, chunk_size).transpose(0, 2, 1, 3)
-    return np.ascontiguousarray(reshaped.reshape(-1))
+        # Drop the mappings before renaming or deleting the files beneath them.
+        del source, targets
+        if not completed:
+            for temp_path in temp_paths.values():
+                temp_path.unlink(missing_ok=True)
 
+    for chunk_size, output_path in outputs.items():
+        temp_paths[chunk_size].replace(output_path)
+        print(f"  Wrote {output_path.name} ({chunks_x * chunk_size}x{chunks_y * chunk_size})")
 
-def downsample_by_two(grid: np.ndarray) -> np.ndarray:
-    return 0.25 * (
-        grid[0::2, 0::2] +
-        grid[1::2, 0::2] +
-        grid[0::2, 1::2] +
-        grid[1::2, 1::2]
-    )
 
-
-def process_file(path: Path, overwrite: bool, min_chunk_size: int) -> None:
-    base_chunk = extract_chunk_size(path)
+def process_file(path: Path, overwrite: bool, min_chunk_size: int, manifest: bool = False) -> None:
+    name_prefix, base_chunk, name_suffix = split_chunked_name(path)
     if base_chunk <= min_chunk_size:
         return
 
+    bounds = parse_lat_lon_bounds(path.name)
     lat_span, lon_span = parse_lat_lon_span(path.name)
     total_values = path.stat().st_size // FLOAT32_BYTES
     chunks_y, chunks_x = infer_chunk_grid(total_values, base_chunk, lat_span, lon_span)
 
     print(f"Processing {path.name}: chunk {base_chunk} -> down to {min_chunk_size}")
-    current_grid = chunked_to_full(path, base_chunk, chunks_y, chunks_x)
-    current_chunk = base_chunk
 
+    # Every level shares the same chunk grid, so each input chunk maps onto
+    # the chunk with the same (y, x) index in every smaller level.
+    outputs = {}
+    current_chunk = base_chunk
     while current_chunk > min_chunk_size:
         if current_chunk % 2 != 0:
             raise ValueError(f"Chunk size {current_chunk} is not divisible by 2")
-        next_chunk = current_chunk // 2
-        current_grid = downsample_by_two(current_grid)
-        output_path = update_chunk_size_in_name(path, next_chunk)
+        current_chunk //= 2
+        output_path = path.with_name(f"{name_prefix}{current_chunk}{name_suffix}")
         if output_path.exists() and not overwrite:
             print(f"  Skipping existing {output_path.name}")
         else:
-            chunked = full_to_chunked(current_grid, next_chunk, chunks_y, chunks_x)
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            chunked.astype("<f4").tofile(output_path)
-            print(f"  Wrote {output_path.name} ({current_grid.shape[1]}x{current_grid.shape[0]})")
-        current_chunk = next_chunk
+            outputs[current_chunk] = output_path
+
+    if outputs:
+        write_levels(path, outputs, chunks_y, chunks_x, base_chunk, min_chunk_size)
 
-    del current_grid
+    # Only describe the pyramid once every level it lists is on disk.
+    if manifest:
+        manifest_path = write_manifest(path, name_prefix, name_suffix, bounds, chunks_y, chunks_x, base_chunk, min_chunk_size)
+        print(f"  Wrote {manifest_path.name}")
 
 
 def main() -> None:
@@ -159,6 +270,7 @@ def main() -> None:
     parser.add_argument("--source-dir", type=Path, default=Path(".data/proc"), help="Directory containing *_CHUNKED_512.DAT files")
     parser.add_argument("--overwrite", action="store_true", help="Overwrite existing downsampled files")
     parser.add_argument("--min-chunk", type=int, default=2, help="Smallest chunk size to emit (default: 2)")
+    parser.add_argument("--manifest", action="store_true", help="Also write a *_PYRAMID.json manifest describing each tile's levels")
     args = parser.parse_args()
 
     source_dir = args.source_dir
@@ -174,7 +286,7 @@ def main() -> None:
         iterator = tqdm(files, desc="Tiles", unit="file")  # type: ignore
 
     for file_path in iterator:
-        process_file(file_path, overwrite=args.overwrite, min_chunk_size=args.min_chunk)
+        process_file(file_path, overwrite=args.overwrite, min_chunk_size=args.min_chunk, manifest=args.manifest)
 
 
 if __name__ == "__main__":
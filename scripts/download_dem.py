@@ -1,6 +1,8 @@
 #! /usr/bin/env python3
 
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from tqdm import tqdm
@@ -13,6 +15,10 @@ TILE_DEGREE_SIZE = 1
 DATA_URL_TEMPLATE = 'http://imbrium.mit.edu/DATA/SLDEM2015/TILES/FLOAT_IMG/SLDEM2015_512_{lat_range}_{lon_range}_FLOAT.IMG'
 DATA_FILE_TEMPLATE = '.data/dem/SLDEM2015_512_{lat_range}_{lon_range}_FLOAT.IMG'
 
+MAX_WORKERS = 8
+RANGE_PARTS = 8
+DOWNLOAD_CHUNK_BYTES = 1 << 20
+
 lat_ranges = ['00N_30N', '30N_60N', '30S_00S', '60S_30S']
 lon_ranges = ['000_045', '045_090', '090_135', '135_180',
               '180_225', '225_270', '270_315', '315_360']
@@ -23,39 +29,211 @@ lon_ranges = ['000_045', '045_090', '090_135', '135_180',
 
 # try to open imgFile and lblFile, if not present download from imgUrl and lblUrl
 
-def download_with_progress(url, filepath):
-    """Download a file with a progress bar."""
-    response = requests.get(url, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-    
-    with open(filepath, 'wb') as f, tqdm(
-        desc=os.path.basename(filepath),
-        total=total_size,
-        unit='B',
-        unit_scale=True,
-        unit_divisor=1024,
-    ) as progress_bar:
-        for chunk in response.iter_content(chunk_size=8192):
+def split_range(start, end, step):
+    """Split the half-open byte span [start, end) into inclusive (first, last) ranges of at most `step` bytes."""
+    return [(offset, min(offset + step, end) - 1) for offset in range(start, end, step)]
+
+
+def read_done_ranges(done_path):
+    """Read the inclusive byte ranges recorded as finished in a `.part.done` file."""
+    if not os.path.exists(done_path):
+        return []
+    with open(done_path) as f:
+        return [tuple(int(v) for v in line.split('-')) for line in f if line.strip()]
+
+
+def missing_ranges(done_ranges, total_size):
+    """Return the half-open spans of [0, total_size) not covered by `done_ranges`."""
+    gaps = []
+    cursor = 0
+    for first, last in sorted(done_ranges):
+        if first > cursor:
+            gaps.append((cursor, first))
+        cursor = max(cursor, last + 1)
+    if cursor < total_size:
+        gaps.append((cursor, total_size))
+    return gaps
+
+
+def plan_download(session, url, filepath):
+    """Compare a local file against the server and prepare what is left to fetch.
+
+    Returns `(remaining_bytes, ranges)`; no ranges means the file is complete.
+    Downloads go to `<filepath>.part`. When the server advertises
+    `Accept-Ranges: bytes`, every finished range is appended to
+    `<filepath>.part.done`, so an interrupted `.part` resumes with only the
+    missing ranges, and a short `.IMG` left by an older sequential download
+    is kept as a finished prefix. Otherwise a single `None` part streams the
+    whole file again. Without a usable Content-Length an existing file is
+    assumed complete.
+    """
+    partFile = filepath + '.part'
+    doneFile = partFile + '.done'
+
+    head = session.head(url, allow_redirects=True)
+    head.raise_for_status()
+    total_size = int(head.headers.get('content-length', 0))
+    if total_size <= 0:
+        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+            return 0, []
+        open(partFile, 'wb').close()
+        return 0, [None]
+
+    accepts_ranges = head.headers.get('accept-ranges', '').lower() == 'bytes'
+    step = -(-total_size // RANGE_PARTS)
+
+    if os.path.exists(filepath):
+        local_size = os.path.getsize(filepath)
+        if local_size == total_size:
+            return 0, []
+        if accepts_ranges and 0 < local_size < total_size:
+            print(f"{filepath} is incomplete ({local_size}/{total_size} bytes), resuming.")
+            # Record the prefix before moving the file, so a failure later in
+            # this run still resumes from it next time.
+            with open(doneFile, 'w') as f:
+                f.write(f"0-{local_size - 1}\n")
+            os.replace(filepath, partFile)
+        else:
+            print(f"{filepath} does not match the remote size, downloading again.")
+            os.remove(filepath)
+
+    if (accepts_ranges and os.path.exists(partFile) and os.path.exists(doneFile)
+            and os.path.getsize(partFile) <= total_size):
+        with open(partFile, 'r+b') as f:
+            f.truncate(total_size)
+        gaps = missing_ranges(read_done_ranges(doneFile), total_size)
+        if not gaps:
+            os.replace(partFile, filepath)
+            os.remove(doneFile)
+            return 0, []
+        ranges = [r for gap_start, gap_end in gaps for r in split_range(gap_start, gap_end, step)]
+        return sum(gap_end - gap_start for gap_start, gap_end in gaps), ranges
+
+    # Start over: preallocate so each range can be written in place.
+    with open(partFile, 'wb') as f:
+        f.truncate(total_size)
+    if not accepts_ranges:
+        if os.path.exists(doneFile):
+            os.remove(doneFile)
+        return total_size, [None]
+    open(doneFile, 'w').close()
+    return total_size, split_range(0, total_size, step)
+
+
+def download_with_progress(session, url, filepath, byte_range, progress_bar, stop_event=None):
+    """Download one byte range of a file (or all of it), updating a shared progress bar.
+
+    Raises if fewer or more bytes arrive than the range (or, for a whole-file
+    download, the response's Content-Length) promises, so a dropped
+    connection is never recorded as a finished part.
+    """
+    # Ask for the raw bytes so Content-Length counts what iter_content yields.
+    headers = {'Accept-Encoding': 'identity'}
+    offset = 0
+    if byte_range is not None:
+        offset = byte_range[0]
+        headers['Range'] = f'bytes={byte_range[0]}-{byte_range[1]}'
+
+    with session.get(url, headers=headers, stream=True) as response, open(filepath, 'r+b') as f:
+        response.raise_for_status()
+        if byte_range is not None:
+            if response.status_code != 206:
+                raise RuntimeError(f"Server ignored range request for {url}")
+            expected = byte_range[1] - byte_range[0] + 1
+        elif 'content-length' in response.headers:
+            expected = int(response.headers['content-length'])
+        else:
+            expected = None
+
+        f.seek(offset)
+        received = 0
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+            if stop_event is not None and stop_event.is_set():
+                raise RuntimeError(f"Download of {url} cancelled")
             if chunk:
                 f.write(chunk)
+                received += len(chunk)
                 progress_bar.update(len(chunk))
+        if byte_range is None:
+            # Drop any preallocated tail, so a short stream without a
+            # Content-Length shows up as a size mismatch on the next run.
+            f.truncate()
 
+    if expected is not None and received != expected:
+        raise RuntimeError(f"Incomplete download of {url}: got {received} of {expected} bytes at offset {offset}")
 
 
+def download_part(session, url, imgFile, byte_range, progress_bar, tile_state, stop_event):
+    """Fetch one part of a tile, record it, and rename the tile once all of its parts are done."""
+    partFile = imgFile + '.part'
+    doneFile = partFile + '.done'
+    download_with_progress(session, url, partFile, byte_range, progress_bar, stop_event)
+
+    with tile_state['lock']:
+        if byte_range is not None:
+            with open(doneFile, 'a') as f:
+                f.write(f"{byte_range[0]}-{byte_range[1]}\n")
+        tile_state['remaining'] -= 1
+        if tile_state['remaining'] == 0:
+            os.replace(partFile, imgFile)
+            if os.path.exists(doneFile):
+                os.remove(doneFile)
 
-def main():
 
-    for lat_range in lat_ranges:
-        for lon_range in lon_ranges:
 
-            imgUrl = DATA_URL_TEMPLATE.replace('{lat_range}', lat_range).replace('{lon_range}', lon_range)
-            imgFile = DATA_FILE_TEMPLATE.replace('{lat_range}', lat_range).replace('{lon_range}', lon_range)
 
-            if not os.path.exists(imgFile): 
-               print(f"Downloading {imgUrl}...")
-               download_with_progress(imgUrl, imgFile)
-            else:
-               print(f"{imgFile} already exists, skipping download.")
+def main():
+
+    with requests.Session() as session:
+        parts = []
+        tiles = 0
+        total_bytes = 0
+        for lat_range in lat_ranges:
+            for lon_range in lon_ranges:
+
+                imgUrl = DATA_URL_TEMPLATE.replace('{lat_range}', lat_range).replace('{lon_range}', lon_range)
+                imgFile = DATA_FILE_TEMPLATE.replace('{lat_range}', lat_range).replace('{lon_range}', lon_range)
+
+                remaining_bytes, ranges = plan_download(session, imgUrl, imgFile)
+                if not ranges:
+                    print(f"{imgFile} already exists, skipping download.")
+                    continue
+
+                tile_state = {'lock': threading.Lock(), 'remaining': len(ranges)}
+                tiles += 1
+                total_bytes += remaining_bytes
+                parts.extend((imgUrl, imgFile, byte_range, tile_state) for byte_range in ranges)
+
+        if not parts:
+            return
+
+        print(f"Downloading {tiles} files in {len(parts)} parts with {MAX_WORKERS} workers...")
+        errors = []
+        stop_event = threading.Event()
+        with tqdm(
+            desc='SLDEM2015',
+            total=total_bytes or None,
+            unit='B',
+            unit_scale=True,
+            unit_divisor=1024,
+        ) as progress_bar, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            try:
+                futures = [executor.submit(download_part, session, url, path, byte_range, progress_bar, tile_state, stop_event)
+                           for url, path, byte_range, tile_state in parts]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(e)
+            except BaseException:
+                # Ctrl-C: drop queued parts and make running ones bail out at
+                # their next chunk; the .part/.part.done files resume them.
+                stop_event.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    if errors:
+        raise SystemExit(f"{len(errors)} download parts failed (first error: {errors[0]}); rerun to resume.")
 
 
 
@@ -7,15 +7,25 @@ kMaxCameraDistance = 20000.0
 kScrollMinSpeed = 60.0
 kScrollMaxSpeed = 1800.0
 
+kScrollDistanceRange = max(kMaxCameraDistance - kMinCameraDistance, 1.0)
+kScrollSpeedSpan = kScrollMaxSpeed - kScrollMinSpeed
+
 def compute_scroll_zoom_speed(camera_distance):
     """
     Python implementation of the C++ computeScrollZoomSpeed function.
+    Accepts a scalar or an array of camera distances.
     """
-    range_dist = max(kMaxCameraDistance - kMinCameraDistance, 1.0)
-    ratio = (camera_distance - kMinCameraDistance) / range_dist
-    ratio = np.clip(ratio, 0.0, 1.0)
-    eased = ratio * ratio * ratio  # smooth ease-out
-    return kScrollMinSpeed + (kScrollMaxSpeed - kScrollMinSpeed) * eased
+    ratio = np.asarray(camera_distance, dtype=float) - kMinCameraDistance
+    ratio *= 1.0 / kScrollDistanceRange
+    if not ratio.ndim:
+        ratio = np.clip(ratio, 0.0, 1.0)
+        return kScrollMinSpeed + kScrollSpeedSpan * (ratio * ratio * ratio)
+    np.clip(ratio, 0.0, 1.0, out=ratio)
+    speed = ratio * ratio  # smooth ease-out: ratio ** 3
+    speed *= ratio
+    speed *= kScrollSpeedSpan
+    speed += kScrollMinSpeed
+    return speed
 
 # Generate a range of camera distances
 camera_distances = np.linspace(kMinCameraDistance, kMaxCameraDistance, 500)
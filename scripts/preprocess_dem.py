@@ -1,7 +1,8 @@
+import mmap
 import os
 import numpy as np
 import argparse
-import sys
+from tqdm import tqdm
 
 # These constants are derived from the terrain_loader.hpp file.
 # They describe the dimensions of the source DEM files.
@@ -13,6 +14,25 @@ SOURCE_DTYPE = np.float32 # The C++ code uses 'float'
 # 512x512 is a good starting point as it's a common texture/tile size.
 CHUNK_SIZE = 512
 
+def advise_memmap(memmap, advice_name, start=0, length=0):
+    """
+    Pass an madvise() hint for a numpy memmap to the kernel, if the platform supports it.
+
+    Args:
+        memmap (np.memmap): The mapped array.
+        advice_name (str): Name of an mmap.MADV_* constant, e.g. 'MADV_SEQUENTIAL'.
+        start (int): Page-aligned byte offset into the mapping.
+        length (int): Number of bytes to advise on; 0 covers the whole mapping.
+    """
+    advice = getattr(mmap, advice_name, None)
+    raw_map = getattr(memmap, '_mmap', None)
+    if advice is None or raw_map is None or not hasattr(raw_map, 'madvise'):
+        return
+    if length:
+        raw_map.madvise(advice, start, length)
+    else:
+        raw_map.madvise(advice)
+
 def preprocess_tile(source_path, dest_path):
     """
     Reads a large row-major DEM file and rewrites it into a chunked format.
@@ -36,6 +56,7 @@ def preprocess_tile(source_path, dest_path):
         # Use numpy.memmap to open the file without loading it all into RAM.
         # This treats the massive file on disk as if it were an in-memory array.
         source_map = np.memmap(source_path, dtype=SOURCE_DTYPE, mode='r', shape=(TILE_HEIGHT, TILE_WIDTH))
+        advise_memmap(source_map, 'MADV_SEQUENTIAL')
 
         num_chunks_y = TILE_HEIGHT // CHUNK_SIZE
         num_chunks_x = TILE_WIDTH // CHUNK_SIZE
@@ -45,30 +66,31 @@ def preprocess_tile(source_path, dest_path):
         print(f"  > Chunk Grid: {num_chunks_x}x{num_chunks_y} ({total_chunks} total chunks)")
         print(f"  > Writing to '{os.path.basename(dest_path)}'")
 
-        with open(dest_path, 'wb') as dest_file:
-            # Iterate through the file in chunk-sized blocks
+        # The destination is laid out as (chunk_y, chunk_x, row, col), so a whole
+        # row of chunks can be reordered with a single reshape/transpose copy.
+        dest_map = np.memmap(dest_path, dtype=SOURCE_DTYPE, mode='w+',
+                             shape=(num_chunks_y, num_chunks_x, CHUNK_SIZE, CHUNK_SIZE))
+        advise_memmap(dest_map, 'MADV_SEQUENTIAL')
+        band_bytes = CHUNK_SIZE * TILE_WIDTH * SOURCE_DTYPE().itemsize
+
+        # Iterate through the file one band of CHUNK_SIZE rows at a time
+        with tqdm(total=total_chunks, mininterval=0.5, unit='chunk', desc='  > Progress') as progress_bar:
             for chunk_y in range(num_chunks_y):
-                for chunk_x in range(num_chunks_x):
-                    # Define the boundaries for the slice
-                    y_start = chunk_y * CHUNK_SIZE
-                    y_end = y_start + CHUNK_SIZE
-                    x_start = chunk_x * CHUNK_SIZE
-                    x_end = x_start + CHUNK_SIZE
-
-                    # Extract the 2D chunk from the memory-mapped file
-                    chunk_data = source_map[y_start:y_end, x_start:x_end]
-
-                    # Write the chunk's raw bytes to the new file.
-                    # The chunks are written one after another, contiguously.
-                    dest_file.write(chunk_data.tobytes())
-
-                    # Progress indicator
-                    chunk_index = chunk_y * num_chunks_x + chunk_x
-                    progress = (chunk_index + 1) / total_chunks
-                    sys.stdout.write(f"\r  > Progress: [{int(progress * 100):3d}%]")
-                    sys.stdout.flush()
-
-        print("\n  > Done.\n")
+                y_start = chunk_y * CHUNK_SIZE
+                y_end = y_start + CHUNK_SIZE
+
+                # Start paging in the next band while this one is reordered
+                if chunk_y + 1 < num_chunks_y:
+                    advise_memmap(source_map, 'MADV_WILLNEED', (chunk_y + 1) * band_bytes, band_bytes)
+
+                band = source_map[y_start:y_end]
+                dest_map[chunk_y] = band.reshape(CHUNK_SIZE, num_chunks_x, CHUNK_SIZE).transpose(1, 0, 2)
+                progress_bar.update(num_chunks_x)
+
+        dest_map.flush()
+        del dest_map
+
+        print("  > Done.\n")
 
     except Exception as e:
         print(f"\nAn error occurred while processing {source_path}: {e}")